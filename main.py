@@ -1,19 +1,33 @@
 # Language specified - pan+eng+hin
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import pdfplumber
 import ocrmypdf
 import tempfile
 import os
+# Read by OpenMP when libtesseract loads, so it has to be set before the tesserocr import
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
 from typing import List
-from docx import Document
+from functools import lru_cache
+from lxml import etree
 from PIL import Image
 import jwt
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import fitz  # PyMuPDF
-import pytesseract
+import diskcache
+import numpy as np
+from tesserocr import PyTessBaseAPI, PSM, OEM
 import io
+import re
+import hashlib
+import sqlite3
+import shutil
+import zipfile
+import time
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 
 app = FastAPI()
@@ -23,6 +37,55 @@ load_dotenv()
 JWT_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256") 
 
+DEFAULT_LANGUAGES = 'pan+eng+hin'
+IMAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.tiff', '.bmp'})
+MIN_TEXT_LAYER_CHARS = 50
+# 72 DPI is too coarse for Gurmukhi/Devanagari matras
+OCR_RENDER_DPI = 200
+# Script detection only needs coarse glyph shapes, but OSD gets unreliable much below 150
+OSD_RENDER_DPI = 150
+# Pages brighter than this (about two lines of text at 200 DPI) are OCR'd as sparse text; anything
+# with more text keeps full layout analysis, since sparse mode gives no reading order. A 10-line
+# letter already averages ~0.985, a full page ~0.92.
+PSM_SPARSE_MIN_BRIGHTNESS = 0.996
+# PDFs with fewer pages to OCR than this skip document-level script detection
+SCRIPT_DETECT_MIN_PAGES = 3
+OSD_MIN_SCRIPT_CONF = 2.0
+# Pages OCR'd with the detected subset below this mean confidence are redone with all languages
+OCR_RETRY_MAX_CONF = 60
+# Models kept for a page whose detected script is the key; Indic pages keep eng for
+# the Latin words and digits that are common in them
+_SCRIPT_LANGUAGES = {
+    'Latin': ('eng',),
+    'Gurmukhi': ('pan', 'eng'),
+    'Devanagari': ('hin', 'eng'),
+}
+# Uploads below this size are OCR'd through in-memory buffers instead of temp files
+OCR_IN_MEMORY_THRESHOLD = int(os.getenv("OCR_IN_MEMORY_THRESHOLD", 8 * 1024 * 1024))
+# ocrmypdf worker count per call. Keep at 1 when several uvicorn workers / pool processes
+# run OCR at once; set it to the core count for a single-worker deployment (the Dockerfile does).
+OCR_JOBS = int(os.getenv("OCR_JOBS", "1"))
+# Loaded Tesseract models per pool worker: the default set plus the per-script subsets
+TESS_API_CACHE_SIZE = 4
+# Verified JWT payloads, re-verified at least every TOKEN_CACHE_TTL seconds
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 60
+# Size of the process pool that runs all OCR work, per uvicorn worker
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count()))
+
+# Extracted text keyed by upload hash, so retried uploads skip OCR. Off unless a directory is
+# configured: the cache holds document contents, so it must not land in a shared default path.
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR")
+OCR_CACHE_SIZE_LIMIT = 10 * 1024 ** 3
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", 7 * 24 * 3600))
+
+# Matches exactly the characters for which str.isalnum() is False
+_NON_ALNUM_RE = re.compile(r'[\W_]+')
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P, _W_T, _W_TAB, _W_BR = _W_NS + "p", _W_NS + "t", _W_NS + "tab", _W_NS + "br"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
 security = HTTPBearer()
 
 def create_token():
@@ -33,9 +96,31 @@ def create_token():
     }
     return jwt.encode(payload, JWT_KEY, algorithm=ALGORITHM)
 
+# token -> (payload, cached_until); dict order doubles as insertion order for eviction
+_token_cache = {}
+# verify_token runs on FastAPI's threadpool; lookups are atomic dict reads, mutations take the lock
+_token_cache_lock = threading.Lock()
+
+def _decode_token(token: str) -> dict:
+    now = time.time()
+    entry = _token_cache.get(token)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    payload = jwt.decode(token, JWT_KEY, algorithms=[ALGORITHM])
+    with _token_cache_lock:
+        if len(_token_cache) >= TOKEN_CACHE_SIZE:
+            for cached_token, (_, cached_until) in list(_token_cache.items()):
+                if cached_until <= now:
+                    del _token_cache[cached_token]
+            if len(_token_cache) >= TOKEN_CACHE_SIZE:
+                del _token_cache[next(iter(_token_cache))]
+        # Never serve a payload past its exp; the next miss lets jwt.decode reject it
+        _token_cache[token] = (payload, min(now + TOKEN_CACHE_TTL, payload.get("exp", float("inf"))))
+    return payload
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(credentials.credentials, JWT_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(credentials.credentials)
         if payload.get("property") != "Punjab Government":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -51,144 +136,414 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         )
 
 
-def process_pdf_ocrmypdf(file, languages='pan+eng+hin'):
-    text = ""
-    try:
-        file.file.seek(0)
-        with pdfplumber.open(file.file) as pdf:
-            text = " ".join(page.extract_text() or "" for page in pdf.pages)
-        if not text.strip():
-            raise Exception("No text found - need OCR")
-    except Exception:
-        file.file.seek(0)
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_input:
-            temp_input.write(file.file.read())
-            temp_input_path = temp_input.name
-        
-        temp_output_path = temp_input_path + "_ocr.pdf"
-        try:
-            ocrmypdf.ocr(
-                input_file=temp_input_path,
-                output_file=temp_output_path,
-                language=languages,
-                force_ocr=True,
-                progress_bar=False
-            )
-            with pdfplumber.open(temp_output_path) as pdf:
-                text = " ".join(page.extract_text() or "" for page in pdf.pages)
-        finally:
-            for path in [temp_input_path, temp_output_path]:
-                try:
-                    if os.path.exists(path):
-                        os.remove(path)
-                except Exception:
-                    pass
-    return text
+def _pdf_page_texts(pdf_document, page_indices=None):
+    if page_indices is None:
+        page_indices = range(pdf_document.page_count)
+    return [pdf_document[i].get_text("text") for i in page_indices]
 
-def process_pdf_tesseract(file, languages='pan+eng+hin'):
-    text = ""
-    file.file.seek(0)
-    pdf_bytes = file.file.read()
-    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-      
-        pix = page.get_pixmap()
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
-        
-        page_text = pytesseract.image_to_string(
-            img,
-            lang=languages,
-            config='--psm 3'
+def _ocrmypdf_extract(data, languages='pan+eng+hin', suffix=".pdf", page_indices=None, **ocr_options):
+    # Returns one text per page; page_indices limits both the OCR run and the result
+    if page_indices is not None:
+        ocr_options['pages'] = ','.join(str(i + 1) for i in page_indices)
+    if len(data) < OCR_IN_MEMORY_THRESHOLD:
+        # Small uploads never touch our temp dir
+        output = io.BytesIO()
+        ocrmypdf.ocr(
+            input_file=io.BytesIO(data),
+            output_file=output,
+            language=languages,
+            force_ocr=True,
+            jobs=OCR_JOBS,
+            # Page workers as threads: we already run inside an OCR_POOL process,
+            # and the heavy lifting happens in Tesseract/Ghostscript subprocesses anyway
+            use_threads=True,
+            progress_bar=False,
+            **ocr_options
         )
-        text += page_text + " "
-    
-    pdf_document.close()
-    return text
-
-def process_docx(file):
-    file.file.seek(0)
-    doc = Document(file.file)
-    return " ".join(para.text for para in doc.paragraphs if para.text.strip())
+        with fitz.open(stream=output.getvalue(), filetype="pdf") as pdf_document:
+            return _pdf_page_texts(pdf_document, page_indices)
 
-def process_image_ocrmypdf(file, languages='pan+eng+hin'):
-    file.file.seek(0)
-    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.filename)[1], delete=False) as temp_img:
-        temp_img.write(file.file.read())
-        temp_img_path = temp_img.name
-    
-    temp_pdf_path = temp_img_path + ".pdf"
-    temp_output_path = temp_img_path + "_ocr.pdf"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_input:
+        temp_input.write(data)
+        temp_input_path = temp_input.name
     
+    temp_output_path = temp_input_path + "_ocr.pdf"
     try:
-        image = Image.open(temp_img_path)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        image.save(temp_pdf_path, 'PDF')
-
         ocrmypdf.ocr(
-            input_file=temp_pdf_path,
+            input_file=temp_input_path,
             output_file=temp_output_path,
             language=languages,
             force_ocr=True,
-            progress_bar=False
+            jobs=OCR_JOBS,
+            use_threads=True,
+            progress_bar=False,
+            **ocr_options
         )
-        
-        with pdfplumber.open(temp_output_path) as pdf:
-            return " ".join(page.extract_text() or "" for page in pdf.pages)
+        # MuPDF reads the file itself, without copying it through Python buffers
+        with fitz.open(temp_output_path) as pdf_document:
+            return _pdf_page_texts(pdf_document, page_indices)
     finally:
-        for path in [temp_img_path, temp_pdf_path, temp_output_path]:
+        for path in [temp_input_path, temp_output_path]:
             try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except Exception:
+                os.remove(path)
+            except OSError:
                 pass
 
-def process_image_tesseract(file, languages='pan+eng+hin'):
-    file.file.seek(0)
-    img = Image.open(io.BytesIO(file.file.read()))
-    ocr_text = pytesseract.image_to_string(
-        img,
-        lang=languages,
-        config='--psm 3'
-    )
-    return ocr_text
-
-def get_file_text_ocrmypdf(files: List[UploadFile], languages='pan+eng+hin'):
-    text = []
-    for file in files:
-        ext = os.path.splitext(file.filename)[1].lower()
-        try:
-            if ext == '.pdf':
-                text.append(process_pdf_ocrmypdf(file, languages))
-            elif ext == '.docx':
-                text.append(process_docx(file))
-            elif ext in ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']:
-                text.append(process_image_ocrmypdf(file, languages))
+def process_pdf_ocrmypdf(data, languages='pan+eng+hin'):
+    try:
+        with fitz.open(stream=data, filetype="pdf") as pdf_document:
+            page_texts = _pdf_page_texts(pdf_document)
+    except Exception:
+        return " ".join(_ocrmypdf_extract(data, languages))
+
+    ocr_pages = [i for i, text in enumerate(page_texts) if not text.strip()]
+    if len(ocr_pages) == len(page_texts):
+        return " ".join(_ocrmypdf_extract(data, languages))
+    if ocr_pages:
+        # One ocrmypdf run over just the pages without a text layer
+        ocr_texts = _ocrmypdf_extract(data, languages, page_indices=ocr_pages)
+        for i, text in zip(ocr_pages, ocr_texts):
+            page_texts[i] = text
+    return " ".join(page_texts)
+
+_tess_apis = {}
+
+def get_tess_api(languages):
+    # Pool workers run one task at a time, so the per-process cache needs no locking.
+    # Dict order doubles as LRU order: hits are re-inserted at the end.
+    api = _tess_apis.pop(languages, None)
+    if api is None:
+        api = PyTessBaseAPI(lang=languages, psm=PSM.AUTO)
+        if len(_tess_apis) >= TESS_API_CACHE_SIZE:
+            _tess_apis.pop(next(iter(_tess_apis))).End()
+    _tess_apis[languages] = api
+    return api
+
+_osd_api = None
+
+def get_osd_api():
+    # Script detection needs osd.traineddata, a legacy-engine model; the recognition models
+    # (tessdata_fast LSTM only) can't classify scripts. One instance per worker is enough.
+    global _osd_api
+    if _osd_api is None:
+        _osd_api = PyTessBaseAPI(lang='osd', psm=PSM.OSD_ONLY, oem=OEM.TESSERACT_ONLY)
+    return _osd_api
+
+def _init_ocr_worker():
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    # Load the default traineddata as soon as the worker starts (start_ocr_pool starts them all
+    # on startup). A missing model must not kill the worker; the request that needs it reports the error.
+    try:
+        get_tess_api(DEFAULT_LANGUAGES)
+    except RuntimeError:
+        pass
+    try:
+        get_osd_api()
+    except RuntimeError:
+        pass
+
+# Created on startup so request handlers never build a pool of their own
+OCR_POOL = None
+_ocr_pool_lock = threading.Lock()
+
+def _new_ocr_pool():
+    pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=_init_ocr_worker)
+    # The executor forks nothing until its first submit, and with fork that submit starts every
+    # worker. Do it right away rather than in the middle of the next request.
+    pool.submit(os.getpid).result()
+    return pool
+
+def submit_ocr(fn, *args):
+    # A worker that dies (OOM kill, Tesseract abort) breaks the whole executor for good.
+    # The request that was running on it fails; later ones get a fresh pool here.
+    global OCR_POOL
+    pool = OCR_POOL
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        with _ocr_pool_lock:
+            if OCR_POOL is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                OCR_POOL = _new_ocr_pool()
+        return OCR_POOL.submit(fn, *args)
+
+def _choose_psm(img):
+    # Mean brightness of a ~100 px thumbnail is a cheap stand-in for ink density
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("L")
+    thumb = img.reduce(max(1, max(img.size) // 100)).convert("L")
+    brightness = np.asarray(thumb).mean() / 255
+    if brightness > PSM_SPARSE_MIN_BRIGHTNESS:
+        return PSM.SPARSE_TEXT
+    return PSM.AUTO
+
+@lru_cache(maxsize=64)
+def _languages_for_script(script_name, languages):
+    requested = languages.split('+')
+    narrowed = [lang for lang in requested if lang in _SCRIPT_LANGUAGES.get(script_name, ())]
+    # Keep the full set unless the detected script's own model was requested
+    if narrowed and _SCRIPT_LANGUAGES[script_name][0] in narrowed:
+        return '+'.join(narrowed)
+    return languages
+
+def _detect_page_languages(img, languages):
+    try:
+        api = get_osd_api()
+    except RuntimeError:
+        # No osd model installed: OCR with everything that was requested
+        return languages
+    api.SetImage(img)
+    osd = api.DetectOrientationScript()
+    if not osd or osd['script_conf'] < OSD_MIN_SCRIPT_CONF:
+        return languages
+    return _languages_for_script(osd['script_name'], languages)
+
+def _recognize(img, languages, fallback_languages=None):
+    api = get_tess_api(languages)
+    api.SetPageSegMode(_choose_psm(img))
+    api.SetImage(img)
+    text = api.GetUTF8Text()
+    # The document-level language guess can miss on an individual page; low confidence
+    # means the page needs the full requested model set after all. Blank pages score 0 too,
+    # so only pages that produced some text are retried.
+    if (fallback_languages and fallback_languages != languages and text.strip()
+            and api.MeanTextConf() < OCR_RETRY_MAX_CONF):
+        return _recognize(img, fallback_languages)
+    return text
+
+def _render_page(pdf_path, page_index, dpi, centre_only=False):
+    with fitz.open(pdf_path) as pdf_document:
+        page = pdf_document.load_page(page_index)
+        clip = None
+        if centre_only:
+            rect = page.rect
+            clip = fitz.Rect(rect.x0 + rect.width / 4, rect.y0 + rect.height / 4,
+                             rect.x1 - rect.width / 4, rect.y1 - rect.height / 4)
+        # Tesseract binarizes grayscale anyway; rendering to 8-bit gray cuts the buffer by 3x
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+def _detect_pdf_languages(args):
+    pdf_path, page_index, languages, dpi = args
+    # Script detection only needs a sample, so only the centre quarter of the page is rendered
+    return _detect_page_languages(_render_page(pdf_path, page_index, dpi, centre_only=True), languages)
+
+def _ocr_page(args):
+    pdf_path, page_index, languages, fallback_languages, dpi = args
+    return _recognize(_render_page(pdf_path, page_index, dpi), languages, fallback_languages)
+
+def _ocr_image(args):
+    image, languages, fallback_languages = args
+    with Image.open(image) as img:
+        # Tesseract works on gray; JPEGs can even decode straight to it, skipping colour conversion
+        img.draft("L", img.size)
+        if "A" in img.getbands() or "transparency" in img.info:
+            # A plain convert turns transparent pixels black; flatten onto white paper instead
+            rgba = img.convert("RGBA")
+            img = Image.new("L", rgba.size, 255)
+            img.paste(rgba.convert("L"), mask=rgba.getchannel("A"))
+        elif img.mode != "L":
+            img = img.convert("L")
+        return _recognize(img, languages, fallback_languages)
+
+def process_pdf_tesseract(pdf_bytes, page_indices, languages='pan+eng+hin'):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # Write the PDF once; tasks carry its path instead of each pickling the whole document
+        pdf_path = os.path.join(temp_dir, "input.pdf")
+        with open(pdf_path, "wb") as temp_pdf:
+            temp_pdf.write(pdf_bytes)
+
+        # Documents are usually in one script: detect it once from the first page to OCR and
+        # apply it everywhere. Short documents aren't worth the extra detection step.
+        page_languages, fallback_languages = languages, None
+        if len(page_indices) >= SCRIPT_DETECT_MIN_PAGES:
+            page_languages = submit_ocr(
+                _detect_pdf_languages, (pdf_path, page_indices[0], languages, OSD_RENDER_DPI)
+            ).result()
+            fallback_languages = languages
+
+        # Tesseract is single-threaded per worker; parallelism comes from the pool, and each
+        # worker renders its own page, so rasterizing overlaps with OCR on the other workers
+        futures = [
+            submit_ocr(_ocr_page, (pdf_path, i, page_languages, fallback_languages, OCR_RENDER_DPI))
+            for i in page_indices
+        ]
+        return [future.result() for future in futures]
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def _has_usable_text(text, min_chars=MIN_TEXT_LAYER_CHARS):
+    # Text layers from broken font encodings come out as U+FFFD or symbol runs;
+    # only count letters and digits so those pages still go to OCR. Stripping everything
+    # else in one regex pass keeps the count in C instead of a per-character Python loop.
+    return len(_NON_ALNUM_RE.sub('', text)) >= min_chars
+
+def process_pdf_smart(pdf_bytes, languages='pan+eng+hin', min_chars=MIN_TEXT_LAYER_CHARS):
+    texts = []
+    ocr_pages = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        for page in pdf_document:
+            page_text = page.get_text("text")
+            if _has_usable_text(page_text, min_chars):
+                texts.append(page_text)
             else:
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error processing {file.filename}: {str(e)}")
-    return " ".join(text)
-
-def get_file_text_tesseract(files: List[UploadFile], languages='pan+eng+hin'):
-    text = []
-    for file in files:
-        ext = os.path.splitext(file.filename)[1].lower()
+                texts.append("")
+                ocr_pages.append(page.number)
+
+    # Only pages without a usable text layer pay for OCR
+    if ocr_pages:
+        for page_index, page_text in zip(ocr_pages, process_pdf_tesseract(pdf_bytes, ocr_pages, languages)):
+            texts[page_index] = page_text
+    return " ".join(texts)
+
+def process_docx(data):
+    # Stream word/document.xml rather than building python-docx's object tree
+    paragraphs = []
+    with zipfile.ZipFile(io.BytesIO(data)) as docx, docx.open("word/document.xml") as document_xml:
+        for _, para in etree.iterparse(document_xml, tag=_W_P):
+            if next(para.iterancestors(_W_P), None) is not None:
+                # Text-box paragraph: Word writes each box twice, as the mc:Choice drawing and
+                # again as the mc:Fallback VML copy. Drop the copy; leave the original in place
+                # so it is read once, in order, as part of the paragraph that anchors it.
+                if next(para.iterancestors(_MC_FALLBACK), None) is not None:
+                    para.clear()
+                continue
+            para_text = "".join([
+                node.text or "" if node.tag == _W_T else " "
+                for node in para.iter(_W_T, _W_TAB, _W_BR, _W_P) if node is not para
+            ])
+            if para_text.strip():
+                paragraphs.append(para_text)
+            para.clear()
+    return " ".join(paragraphs)
+
+def process_image_ocrmypdf(data, suffix, languages='pan+eng+hin'):
+    # ocrmypdf wraps images into a PDF itself. Opening only reads the header; images it
+    # can't embed (alpha channels, palettes) are the only ones re-encoded here.
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode not in ('RGB', 'L', '1', 'CMYK'):
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'PNG')
+            data, suffix = buffer.getvalue(), '.png'
+    return " ".join(_ocrmypdf_extract(data, languages, suffix=suffix, image_dpi=300))
+
+def process_image_tesseract(data, languages='pan+eng+hin'):
+    return submit_ocr(_ocr_image, (io.BytesIO(data), languages, None)).result()
+
+def _dispatch_ocrmypdf(data, filename, languages='pan+eng+hin'):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.pdf':
+        return process_pdf_ocrmypdf(data, languages)
+    elif ext == '.docx':
+        return process_docx(data)
+    elif ext in IMAGE_EXTENSIONS:
+        return process_image_ocrmypdf(data, ext, languages)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+def _dispatch_tesseract(data, filename, languages='pan+eng+hin'):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.pdf':
+        return process_pdf_smart(data, languages)
+    elif ext == '.docx':
+        return process_docx(data)  # DOCX doesn't need OCR
+    elif ext in IMAGE_EXTENSIONS:
+        return process_image_tesseract(data, languages)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+_text_cache = None
+_CACHE_ERRORS = (OSError, sqlite3.Error, diskcache.Timeout)
+
+def _get_text_cache():
+    # Opened lazily so every worker process gets its own SQLite connection
+    global _text_cache
+    if _text_cache is None:
+        # Owner-only if we create it; diskcache would make it world-readable
+        os.makedirs(OCR_CACHE_DIR, mode=0o700, exist_ok=True)
+        _text_cache = diskcache.Cache(OCR_CACHE_DIR, size_limit=OCR_CACHE_SIZE_LIMIT)
+    return _text_cache
+
+def _extract_cached(dispatch, data, filename, languages='pan+eng+hin'):
+    if not OCR_CACHE_DIR:
+        return dispatch(data, filename, languages)
+    ext = os.path.splitext(filename)[1].lower()
+    key = (hashlib.sha256(data).digest(), dispatch.__name__, ext, languages)
+    # The cache only saves work: if it can't be opened or is locked, extract uncached
+    try:
+        cache = _get_text_cache()
+        text = cache.get(key)
+    except _CACHE_ERRORS:
+        return dispatch(data, filename, languages)
+    if text is None:
+        text = dispatch(data, filename, languages)
         try:
-            if ext == '.pdf':
-                text.append(process_pdf_tesseract(file, languages))
-            elif ext == '.docx':
-                text.append(process_docx(file))  # DOCX doesn't need OCR
-            elif ext in ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']:
-                text.append(process_image_tesseract(file, languages))
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error processing {file.filename}: {str(e)}")
-    return " ".join(text)
+            cache.set(key, text, expire=OCR_CACHE_TTL)
+        except _CACHE_ERRORS:
+            pass
+    return text
+
+def _extract_in_ocr_pool(dispatch, data, filename, languages='pan+eng+hin'):
+    return submit_ocr(_extract_cached, dispatch, data, filename, languages).result()
+
+async def get_file_text(dispatch, files: List[UploadFile], languages='pan+eng+hin', in_ocr_pool=False):
+    loop = asyncio.get_running_loop()
+    datas = await asyncio.gather(*(file.read() for file in files))
+    # Files run on threads either way; pooled extraction waits on OCR_POOL from its thread,
+    # so replacing a broken pool never blocks the event loop
+    extract = _extract_in_ocr_pool if in_ocr_pool else _extract_cached
+    tasks = [
+        loop.run_in_executor(None, extract, dispatch, data, file.filename, languages)
+        for file, data in zip(files, datas)
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            raise HTTPException(status_code=400, detail=f"Error processing {file.filename}: {str(result)}")
+    return " ".join(results)
+
+def normalize_whitespace(text):
+    # str.split() already handles Unicode whitespace (NBSP etc.) for Gurmukhi/Devanagari output
+    if not text.isascii():
+        return " ".join(text.split())
+    # ASCII-only text: one vectorized pass over the bytes, collapsing the same characters
+    # str.split() does (space, \t-\r, \x1c-\x1f) into single spaces
+    buf = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    if not buf.size:
+        return ""
+    ws = (buf == 0x20) | ((buf >= 0x09) & (buf <= 0x0D)) | ((buf >= 0x1C) & (buf <= 0x1F))
+    keep = ~(ws & np.r_[False, ws[:-1]])
+    out = buf[keep]
+    out[ws[keep]] = 0x20
+    return out.tobytes().decode("utf-8").strip()
+
+def _prewarm_ocrmypdf():
+    # The first ocrmypdf run pays for its lazy imports and for reading the tesseract/gs
+    # binaries and traineddata from disk. Doing it before the pool forks keeps that cost
+    # out of the first request.
+    image = io.BytesIO()
+    Image.new('L', (64, 64), 255).save(image, 'PNG')
+    try:
+        ocrmypdf.ocr(
+            input_file=image,
+            output_file=io.BytesIO(),
+            language=DEFAULT_LANGUAGES,
+            image_dpi=300,
+            force_ocr=True,
+            progress_bar=False
+        )
+    except Exception:
+        pass
+
+@app.on_event("startup")
+def start_ocr_pool():
+    global OCR_POOL
+    _prewarm_ocrmypdf()
+    # Before uvicorn serves requests or starts threads of its own
+    OCR_POOL = _new_ocr_pool()
+
+@app.on_event("shutdown")
+def stop_ocr_pool():
+    OCR_POOL.shutdown(cancel_futures=True)
 
 @app.get("/token")
 async def get_token():
@@ -201,8 +556,8 @@ async def ocr_endpoint(
     languages: str = 'pan+eng+hin',
     token_payload: dict = Depends(verify_token)
 ):
-    extracted_text = get_file_text_ocrmypdf(files, languages)
-    cleaned_text = ' '.join(extracted_text.replace('\n', ' ').split())
+    extracted_text = await get_file_text(_dispatch_ocrmypdf, files, languages, in_ocr_pool=True)
+    cleaned_text = normalize_whitespace(extracted_text)
     return {"extracted_text": cleaned_text}
 
 @app.post("/ocr-tesseract")
@@ -211,6 +566,7 @@ async def ocr_tesseract_only(
     languages: str = 'pan+eng+hin',
     token_payload: dict = Depends(verify_token)
 ):
-    extracted_text = get_file_text_tesseract(files, languages)
-    cleaned_text = ' '.join(extracted_text.replace('\n', ' ').split())
+    # Page and image OCR is submitted to the process pool from here, so files only need a thread
+    extracted_text = await get_file_text(_dispatch_tesseract, files, languages)
+    cleaned_text = normalize_whitespace(extracted_text)
     return {"extracted_text": cleaned_text}